@@ -1,11 +1,22 @@
 import os
+import io
+import asyncio
+import atexit
+import hashlib
 import json
+import math
+import re
+import time
 import logging
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import orjson
 import pandas as pd
 from tqdm import tqdm
-from openai import OpenAI
+from tqdm.asyncio import tqdm as async_tqdm
+from openai import OpenAI, AsyncOpenAI, RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 from dotenv import load_dotenv
 
 # Configure logging
@@ -26,27 +37,24 @@ You are an expert medical engineering assistant who specializes in LINAC system
 
 Your job is to review the subject and description of LINAC failure reports and classify each report into one or more Failure Types.
 
-Return your result in JSON format only with key: `failure_type` and value: category (or comma-separated categories) like:
-{
-  "failure_type": "Imaging System (KV/MV)"
-}
+Respond with a JSON object with key `failure_type`, e.g. {"failure_type": "Imaging System (KV/MV)"}
 
 ### Failure Type Categories:
 
-- "Beam Generation": Components responsible for creating, accelerating, and bending the initial electron beam, including the electron gun, linear accelerator, bending magnet, and RF power source (Klystron/Magnetron).
-- "Collimation System": Systems that define the final shape of the radiation beam, including primary jaws, multi-leaf collimator (MLC), target carousel, and flattening filters/scattering foils.
-- "Gantry Motion/Structure": The mechanical system responsible for rotating the gantry, including drive motors, bearings, position sensors (resolvers/encoders), and the structural frame.
-- "Imaging System (KV/MV)": Hardware used for patient setup and verification imaging, including the kV X-ray source, kV flat-panel detector, MV electronic portal imaging device (EPID), and associated retractable arms.
-- "Treatment Couch": The patient support system, including its motorized axes (longitudinal, lateral, vertical, rotation, pitch, roll), control pendants, and structural components.
-- "Control Hardware": The distributed network of physical electronic controllers (Supervisor, Nodes), processing boards, and safety interlock circuit hardware managing machine operations.
-- "System Networks": Communication infrastructure connecting system components, including CAN bus, Ethernet networks, HSSB, and associated wiring/connectors.
-- "Cooling System": Systems managing the thermal environment of critical components, primarily the water cooling system (chiller, pumps, flow sensors) and specialized gas systems (e.g., SF6 for waveguide).
-- "Power System/Distribution": Components managing the input and distribution of electrical power, including the modulator cabinet, main breakers, high-voltage circuits, uninterruptible power supply (UPS), and power conditioning.
-- "Ancillary Room Systems": Supporting equipment within the treatment room, such as positioning lasers, in-room cameras (CCTV/Optical Guidance), and room monitors.
-- "Safety Systems": Components specifically designed for personnel and equipment safety, such as emergency stop buttons, door interlocks, collision detection sensors, and radiation monitoring systems.
-- "Operator Console/UI": User interface systems, display monitors, control pendants, and software interface components.
-
-Each report can have multiple labels separated by comma. Your output must always be in dictionary format with key: `failure_type`.
+- "Beam Generation": electron gun, accelerator, bending magnet, klystron/magnetron RF.
+- "Collimation System": jaws, MLC, target carousel, flattening filter/scattering foils.
+- "Gantry Motion/Structure": gantry drive motors, bearings, resolvers/encoders, frame.
+- "Imaging System (KV/MV)": kV source/detector, MV EPID, imaging arms.
+- "Treatment Couch": couch axes, couch pendants, couch structure.
+- "Control Hardware": Supervisor/Nodes, processing boards, interlock circuit hardware.
+- "System Networks": CAN bus, Ethernet, HSSB, network wiring/connectors.
+- "Cooling System": water cooling (chiller, pumps, flow sensors), SF6 gas.
+- "Power System/Distribution": modulator, breakers, high voltage, UPS, power conditioning.
+- "Ancillary Room Systems": positioning lasers, in-room cameras, room monitors.
+- "Safety Systems": emergency stops, door interlocks, collision sensors, radiation monitors.
+- "Operator Console/UI": consoles, display monitors, control pendants, UI software.
+
+Each report can have multiple labels separated by comma.
 
 Think carefully step by step and analyze the report content logically before classifying.
 """
@@ -66,24 +74,158 @@ Think carefully step by step and analyze the report content logically before cla
             "subject": "Installed floating monitor arms.",
             "description": """Mounted 4 Linac control monitors on the floating arms. Same configuration as Trilogy""",
             "failure_type": "Operator Console/UI"
+        },
+        {
+            "subject": "Couch will not move vertically",
+            "description": """Customer reports couch vertical motion stopped during patient setup, lateral and longitudinal still working. Found couch vertical drive fault on the couch controller. Checked vertical motor brake voltage at the couch controller, brake not releasing. Replaced the vertical brake relay on the couch interface PCB. Recalibrated the vertical potentiometer and verified couch motion in all axes from the pendant and the console. Couch returned to clinical use.""",
+            "failure_type": "Treatment Couch"
+        },
+        {
+            "subject": "Low water flow interlock, machine down",
+            "description": """Found FLOW interlock active on arrival and primary water temperature high. Building chiller was running but inlet pressure to the linac was low. Cleaned the water filter and the strainer on the secondary circuit, found the flow switch sticking. Replaced the flow switch, bled air from the system and topped up distilled water. Flow and temperature returned to specification after warm-up. Ran the beam for 30 minutes with no interlocks.""",
+            "failure_type": "Cooling System"
+        },
+        {
+            "subject": "kV images dark, OBI not acquiring",
+            "description": """Therapists report kV images are dark and CBCT acquisition aborts with a generator fault. Checked kV source tube current during exposure, below expected value. Inspected the HV cable to the kV tube and found a damaged connector. Replaced the HV cable, ran the tube warm-up and repeated the imager calibration. Verified kV image quality with the phantom. Physics verified imaging QA and site resumed treatments.""",
+            "failure_type": "Imaging System (KV/MV)"
+        },
+        {
+            "subject": "Intermittent node communication faults",
+            "description": """Machine intermittently drops out with Stand node communication lost and supervisor reboot required. Checked CAN bus termination and network cabling between the stand and the console, all within specification. Found corrupted log entries on the Stand node and failing memory on the node processor board. Replaced the Stand node PCB and reloaded the node software and configuration. Cycled the machine through all modes for two hours without a fault.""",
+            "failure_type": "Control Hardware"
         }
     ]
     
-    def __init__(self, api_key: Optional[str] = None, model: str = "gpt-4o"):
+    # OpenAI only caches prompt prefixes of at least 1024 tokens. The system
+    # prompt and examples are kept above that; at roughly 4-5 characters per
+    # token, 5,200 characters leaves some margin.
+    MIN_CACHED_PREFIX_CHARS = 5200
+    
+    # Unambiguous component keywords; a report matching exactly one category
+    # is classified without calling the API
+    _KEYWORD_RULES = [
+        (re.compile(r"\b(electron gun|klystron|magnetron|thyratron|bending magnet)\b", re.I),
+         "Beam Generation"),
+        (re.compile(r"\b(mlc|multi-leaf|leaf motor|jaws?|carousel|flattening filter|scattering foil)\b", re.I),
+         "Collimation System"),
+        (re.compile(r"\b(gantry (?:motor|drive|bearing|rotation)|slip ring)\b", re.I),
+         "Gantry Motion/Structure"),
+        (re.compile(r"\b(kv (?:source|imager|detector)|obi|epid|cbct|flat[- ]panel|portal imag\w*)\b", re.I),
+         "Imaging System (KV/MV)"),
+        (re.compile(r"\b((?:couch|treatment table) (?:motor|axis|axes|drive|brake|pendant|encoder)s?)\b", re.I),
+         "Treatment Couch"),
+        (re.compile(r"\b(can bus|hssb|ethernet)\b", re.I),
+         "System Networks"),
+        (re.compile(r"\b(chiller|coolant|water pump|flow sensor|water flow|sf6)\b", re.I),
+         "Cooling System"),
+        (re.compile(r"\b(main breaker|circuit breaker|modulator cabinet|power conditioner)\b", re.I),
+         "Power System/Distribution"),
+        # Case-sensitive, so "follow-ups" and "SET-UPS" are not read as a UPS
+        (re.compile(r"(?<![-\w])UPS\b(?! ?s\b)"),
+         "Power System/Distribution"),
+        (re.compile(r"\b(positioning lasers?|room lasers?|cctv|in-room camera)\b", re.I),
+         "Ancillary Room Systems"),
+        (re.compile(r"\b(emergency stop|e-stop|door interlock|radiation monitor|area monitor)\b", re.I),
+         "Safety Systems"),
+        (re.compile(r"\b(console (?:keyboard|monitor|pc|computer|workstation)s?|monitor arms?)\b", re.I),
+         "Operator Console/UI"),
+    ]
+    
+    # Deterministic sampling in JSON mode, so identical reports get identical answers
+    GENERATION_PARAMS = {
+        "temperature": 0,
+        "seed": 42,
+        "response_format": {"type": "json_object"}
+    }
+    
+    # Batch API limits per input file: request count, and file size (200 MB)
+    # less some headroom
+    BATCH_MAX_REQUESTS = 50000
+    BATCH_MAX_BYTES = 190 * 1024 * 1024
+    
+    EMBEDDING_MODEL = "text-embedding-3-small"
+    EMBEDDING_BATCH_SIZE = 100
+    
+    def __init__(self, api_key: Optional[str] = None, model: str = "gpt-4o",
+                 cheap_model: Optional[str] = "gpt-4o-mini",
+                 confidence_threshold: float = 0.85,
+                 max_description_chars: Optional[int] = 800,
+                 semantic_cache_path: Optional[str] = None,
+                 similarity_threshold: float = 0.95,
+                 exact_cache_path: Optional[str] = None,
+                 use_keyword_rules: bool = True):
         """
         Initialize the classifier.
         
         Args:
             api_key: OpenAI API key. If None, loads from environment.
             model: OpenAI model to use for classification.
+            cheap_model: Cheaper model tried first; reports it classifies with
+                low confidence are escalated to `model`. If None, every report
+                goes straight to `model`.
+            confidence_threshold: Minimum probability of the cheap model's
+                failure type token for its answer to be accepted.
+            max_description_chars: Descriptions longer than this are shortened
+                to their head and tail before being sent. If None, descriptions
+                are sent in full.
+            semantic_cache_path: Path to a `.npz` file for the embedding-based
+                cache of past classifications. If None, the cache is disabled.
+            similarity_threshold: Minimum cosine similarity for a cached
+                classification to be reused.
+            exact_cache_path: Path to a JSON file persisting classifications of
+                byte-identical reports between runs. If None, identical reports
+                are still deduplicated in memory but nothing is written.
+            use_keyword_rules: Classify reports that mention components of
+                exactly one category locally, without an API call.
         """
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OpenAI API key not found. Set OPENAI_API_KEY environment variable or pass api_key parameter.")
         
+        if max_description_chars is not None and max_description_chars <= 0:
+            raise ValueError("max_description_chars must be positive, or None to send full descriptions.")
+        
         self.client = OpenAI(api_key=self.api_key)
+        self.aclient = AsyncOpenAI(api_key=self.api_key)
         self.model = model
+        self.cheap_model = cheap_model if cheap_model != model else None
+        self.confidence_threshold = confidence_threshold
+        self._cascade_counts = {"cheap": 0, "escalated": 0}
+        self.max_description_chars = max_description_chars
         self.formatted_examples = self._format_examples()
+        # Static instructions and examples form a fixed prefix so that
+        # OpenAI's automatic prompt caching can reuse it across requests.
+        self._cached_system = f"""{self.SYSTEM_PROMPT}
+Here are the examples:
+{self.formatted_examples}"""
+        if len(self._cached_system) < self.MIN_CACHED_PREFIX_CHARS:
+            logger.warning(f"System prompt and examples are {len(self._cached_system)} chars, likely "
+                           f"below the 1024 tokens needed for prompt caching")
+        # Cached classifications are only reused under the same configuration
+        self._cache_fingerprint = self._config_fingerprint()
+        
+        # Semantic cache: unit-norm report embeddings and their classifications
+        self.semantic_cache_path = Path(semantic_cache_path) if semantic_cache_path else None
+        if self.semantic_cache_path and self.semantic_cache_path.suffix != ".npz":
+            # np.savez appends .npz, so load from the same name it saves to
+            self.semantic_cache_path = self.semantic_cache_path.with_name(self.semantic_cache_path.name + ".npz")
+        self.similarity_threshold = similarity_threshold
+        self._cache_embs = np.empty((0, 0), dtype=np.float32)
+        self._cache_labels: List[Dict] = []
+        self._pending_embs: Dict[str, np.ndarray] = {}
+        if self.semantic_cache_path and self.semantic_cache_path.exists():
+            self._load_semantic_cache()
+        
+        # Exact-match cache: SHA-1 of (subject, description) -> classification
+        self.exact_cache_path = Path(exact_cache_path) if exact_cache_path else None
+        self._exact_cache: Dict[str, Dict] = {}
+        self.use_keyword_rules = use_keyword_rules
+        if self.exact_cache_path:
+            if self.exact_cache_path.exists():
+                self._load_exact_cache()
+            atexit.register(self.save_exact_cache)
+        
         logger.info(f"Initialized LINACFailureClassifier with model: {model}")
     
     def _format_examples(self) -> str:
@@ -95,6 +237,240 @@ Failure Type: {failure_type}
 """
         return "\n".join([template.format(**ex) for ex in self.EXAMPLES])
     
+    @staticmethod
+    def _truncate_description(text: str, max_chars: Optional[int] = 800) -> str:
+        """
+        Shorten a long description to its opening and closing parts.
+        
+        The fault symptoms are usually stated first and the resolution last,
+        so the head gets three quarters of the budget and the tail the rest.
+        
+        >>> LINACFailureClassifier._truncate_description("abcdefghij", 8)
+        'abcdef ... ij'
+        >>> LINACFailureClassifier._truncate_description("abcdefghij", 2)
+        'ab ... '
+        """
+        if max_chars is None or len(text) <= max_chars:
+            return text
+        tail_chars = max_chars // 4
+        head_chars = max_chars - tail_chars
+        # Slice from an explicit start, since text[-0:] would be the whole text
+        return f"{text[:head_chars].rstrip()} ... {text[len(text) - tail_chars:].lstrip()}"
+    
+    def _build_messages(self, subject: str, description: str) -> List[Dict]:
+        """Build the chat messages for a single report."""
+        description = self._truncate_description(description, self.max_description_chars)
+        # Only the report itself varies between calls; everything else lives
+        # in the cached system prefix.
+        user_prompt = f"""Classify this report:
+Failure_type must be selected exclusively from the defined Failure Type categories.
+
+**LINAC downtime report**
+Subject: {subject}
+Description: {description}
+"""
+        return [
+            {"role": "system", "content": self._cached_system},
+            {"role": "user", "content": user_prompt}
+        ]
+    
+    def _build_batch_messages(self, reports: List[Dict]) -> List[Dict]:
+        """Build the chat messages for several reports classified in one request."""
+        formatted_reports = "\n".join(
+            f"""[{i}]
+Subject: {report['subject']}
+Description: {self._truncate_description(report['description'], self.max_description_chars)}
+"""
+            for i, report in enumerate(reports, start=1)
+        )
+        user_prompt = f"""Classify each of the following reports:
+Failure_type must be selected exclusively from the defined Failure Type categories.
+
+Return a JSON object with key `classifications` holding one object per report, in order,
+each with keys `id` (the report number) and `failure_type`, like:
+{{"classifications": [{{"id": 1, "failure_type": "Beam Generation"}}]}}
+
+**LINAC downtime reports**
+{formatted_reports}"""
+        return [
+            {"role": "system", "content": self._cached_system},
+            {"role": "user", "content": user_prompt}
+        ]
+    
+    def _config_fingerprint(self) -> str:
+        """Hash of every setting that affects a classification result."""
+        config = {
+            "model": self.model,
+            "cheap_model": self.cheap_model,
+            "confidence_threshold": self.confidence_threshold,
+            "max_description_chars": self.max_description_chars,
+            "system": self._cached_system,
+            "generation": self.GENERATION_PARAMS,
+            "embedding_model": self.EMBEDDING_MODEL,
+        }
+        return hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+    
+    def _load_semantic_cache(self):
+        """Load cached embeddings and classifications from disk."""
+        data = np.load(self.semantic_cache_path, allow_pickle=False)
+        if "fingerprint" not in data or str(data["fingerprint"]) != self._cache_fingerprint:
+            logger.info(f"Ignoring semantic cache {self.semantic_cache_path}: built with a different configuration")
+            return
+        self._cache_embs = data["embeddings"].astype(np.float32)
+        self._cache_labels = [json.loads(label) for label in data["labels"]]
+        logger.info(f"Loaded {len(self._cache_labels)} entries from semantic cache {self.semantic_cache_path}")
+    
+    def save_semantic_cache(self):
+        """Persist cached embeddings and classifications to disk."""
+        if not self.semantic_cache_path:
+            return
+        self.semantic_cache_path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            self.semantic_cache_path,
+            embeddings=self._cache_embs,
+            labels=np.array([json.dumps(label) for label in self._cache_labels]),
+            fingerprint=np.array(self._cache_fingerprint)
+        )
+        logger.info(f"Saved {len(self._cache_labels)} entries to semantic cache {self.semantic_cache_path}")
+    
+    def _load_exact_cache(self):
+        """Load exact-match classifications from disk."""
+        with open(self.exact_cache_path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("fingerprint") != self._cache_fingerprint:
+            logger.info(f"Ignoring exact cache {self.exact_cache_path}: built with a different configuration")
+            return
+        self._exact_cache = data["entries"]
+        logger.info(f"Loaded {len(self._exact_cache)} entries from exact cache {self.exact_cache_path}")
+    
+    def save_exact_cache(self):
+        """Persist exact-match classifications to disk."""
+        if not self.exact_cache_path:
+            return
+        self.exact_cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.exact_cache_path, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self._cache_fingerprint, "entries": self._exact_cache}, f)
+    
+    @staticmethod
+    def _exact_key(subject: str, description: str) -> str:
+        """Hash key identifying a report by its exact subject and description."""
+        return hashlib.sha1(f"{subject}\x00{description}".encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def _report_text(subject: str, description: str) -> str:
+        """Text used to embed a report for the semantic cache."""
+        return f"{subject} {description}"
+    
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts in batches and return unit-norm vectors."""
+        vectors = []
+        for start in range(0, len(texts), self.EMBEDDING_BATCH_SIZE):
+            response = self.client.embeddings.create(
+                model=self.EMBEDDING_MODEL,
+                input=texts[start:start + self.EMBEDDING_BATCH_SIZE]
+            )
+            vectors.extend(item.embedding for item in response.data)
+        embs = np.asarray(vectors, dtype=np.float32)
+        return embs / np.linalg.norm(embs, axis=1, keepdims=True)
+    
+    def prefetch_embeddings(self, subjects: List[str], descriptions: List[str]):
+        """
+        Embed many reports up front so `classify_report` does not embed one at a time.
+        
+        Args:
+            subjects: Report subject lines.
+            descriptions: Report description texts, aligned with `subjects`.
+        """
+        texts = list(dict.fromkeys(
+            self._report_text(s, d) for s, d in zip(subjects, descriptions)
+        ))
+        texts = [t for t in texts if t.strip() and t not in self._pending_embs]
+        if not texts:
+            return
+        logger.info(f"Embedding {len(texts)} reports for semantic cache...")
+        for start in range(0, len(texts), self.EMBEDDING_BATCH_SIZE):
+            chunk = texts[start:start + self.EMBEDDING_BATCH_SIZE]
+            try:
+                embs = self._embed(chunk)
+            except Exception as e:
+                # These reports are embedded one at a time by classify_report instead
+                logger.warning(f"Embedding error, skipping prefetch of {len(chunk)} reports: {e}")
+                continue
+            for text, emb in zip(chunk, embs):
+                self._pending_embs[text] = emb
+    
+    def _semantic_lookup(self, query: np.ndarray) -> Optional[Dict]:
+        """Return the cached classification most similar to `query`, if close enough."""
+        if not self._cache_labels:
+            return None
+        scores = self._cache_embs @ query
+        best = int(np.argmax(scores))
+        if scores[best] >= self.similarity_threshold:
+            return dict(self._cache_labels[best])
+        return None
+    
+    def _semantic_store(self, query: np.ndarray, result: Dict):
+        """Add a classification to the semantic cache."""
+        if self._cache_labels:
+            self._cache_embs = np.vstack([self._cache_embs, query])
+        else:
+            self._cache_embs = query[np.newaxis, :]
+        self._cache_labels.append(result)
+    
+    @classmethod
+    def _rule_classify(cls, subject: str, description: str) -> Optional[str]:
+        """Return the only category whose keywords appear in the report, if any.
+
+        Passing mentions of a component must not be classified:
+
+        >>> phrases = [
+        ...     "Scheduled follow-ups with physics.",
+        ...     "Set-ups for morning warm-up verified.",
+        ...     "SET-UPS COMPLETED, did start-ups.",
+        ...     "Checked console logs, no errors found.",
+        ...     "Patient on couch when interlock occurred.",
+        ...     "Customer ups dose rate after warm up.",
+        ...     "Reviewed treatment table of planned fractions.",
+        ... ]
+        >>> [LINACFailureClassifier._rule_classify(p, "") for p in phrases]
+        [None, None, None, None, None, None, None]
+        >>> LINACFailureClassifier._rule_classify("Couch motor stalls on vertical axis", "")
+        'Treatment Couch'
+        >>> LINACFailureClassifier._rule_classify("Site lost power", "UPS battery failed.")
+        'Power System/Distribution'
+        """
+        text = f"{subject}\n{description}"
+        hits = {category for pattern, category in cls._KEYWORD_RULES if pattern.search(text)}
+        if len(hits) == 1:
+            return hits.pop()
+        return None
+    
+    def _local_result(self, subject: str, description: str) -> Optional[Dict]:
+        """Classification from the keyword rules or the exact-match cache, if either has one."""
+        if self.use_keyword_rules:
+            hit = self._rule_classify(subject, description)
+            if hit:
+                return {"failure_type": hit, "source": "rule"}
+        cached = self._exact_cache.get(self._exact_key(subject, description))
+        return dict(cached) if cached is not None else None
+    
+    def _pending_groups(self, reports: List[Tuple[str, str]], results: List[Optional[Dict]]) -> Dict[str, List[int]]:
+        """Group the rows without a result by exact-match key, so each distinct report is sent once."""
+        groups: Dict[str, List[int]] = {}
+        for i, result in enumerate(results):
+            if result is None:
+                groups.setdefault(self._exact_key(*reports[i]), []).append(i)
+        return groups
+    
+    def _fan_out(self, groups: Dict[str, List[int]], results: List[Dict]):
+        """Copy each group's result from its first row to the others and cache it if successful."""
+        for key, rows in groups.items():
+            result = results[rows[0]]
+            for i in rows[1:]:
+                results[i] = dict(result)
+            if "Error" not in result.get("failure_type", "Error"):
+                self._exact_cache[key] = result
+    
     def classify_report(self, subject: str, description: str, max_retries: int = 3) -> Dict:
         """
         Classify a single LINAC failure report.
@@ -107,56 +483,196 @@ Failure Type: {failure_type}
         Returns:
             Dictionary with classification results.
         """
-        user_prompt = f"""Here are the examples:
-{self.formatted_examples}
-
-Classify this report:
-Failure_type must be selected exclusively from the defined Failure Type categories.
-
-**LINAC downtime report**
-Subject: {subject}
-Description: {description}
-"""
+        local = self._local_result(subject, description)
+        if local is not None:
+            return local
+        
+        result = self._classify_semantic(subject, description, max_retries)
+        if "Error" not in result.get("failure_type", "Error"):
+            self._exact_cache[self._exact_key(subject, description)] = result
+        return result
+    
+    def _classify_semantic(self, subject: str, description: str, max_retries: int = 3) -> Dict:
+        """Classify a report, reusing the result of a near-duplicate if one is cached."""
+        if not self.semantic_cache_path:
+            return self._classify_with_llm(subject, description, max_retries)
         
+        text = self._report_text(subject, description)
+        query = self._pending_embs.pop(text, None)
+        if query is None:
+            try:
+                query = self._embed([text])[0]
+            except Exception as e:
+                logger.warning(f"Embedding error, skipping semantic cache: {e}")
+                return self._classify_with_llm(subject, description, max_retries)
+        
+        cached = self._semantic_lookup(query)
+        if cached is not None:
+            return cached
+        
+        result = self._classify_with_llm(subject, description, max_retries)
+        if "Error" not in result.get("failure_type", "Error"):
+            self._semantic_store(query, result)
+        return result
+    
+    def _classify_with_llm(self, subject: str, description: str, max_retries: int = 3) -> Dict:
+        """Classify a single report, escalating from the cheap model when it is unsure."""
+        if not self.cheap_model:
+            return self._call_model(self.model, subject, description, max_retries)[0]
+        
+        result, confidence = self._call_model(
+            self.cheap_model, subject, description, max_retries, logprobs=True
+        )
+        if "Error" not in result.get("failure_type", "Error") and confidence > self.confidence_threshold:
+            self._cascade_counts["cheap"] += 1
+            return result
+        
+        self._cascade_counts["escalated"] += 1
+        return self._call_model(self.model, subject, description, max_retries)[0]
+    
+    @staticmethod
+    def _label_confidence(tokens) -> float:
+        """Probability of the first token of the `failure_type` value."""
+        text = ""
+        for token in tokens or []:
+            text += token.token
+            if re.search(r'"failure_type"\s*:\s*"[^"]', text):
+                return math.exp(token.logprob)
+        return 0.0
+    
+    def _call_model(self, model: str, subject: str, description: str,
+                    max_retries: int = 3, logprobs: bool = False) -> Tuple[Dict, float]:
+        """
+        Classify a single report with one chat model.
+        
+        Returns:
+            Tuple of the classification dictionary and the model's confidence
+            in the label (0.0 unless `logprobs` is requested).
+        """
+        extra = {"logprobs": True, "top_logprobs": 1} if logprobs else {}
         for attempt in range(max_retries):
             try:
                 response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": self.SYSTEM_PROMPT},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=0.7
+                    model=model,
+                    messages=self._build_messages(subject, description),
+                    **self.GENERATION_PARAMS,
+                    **extra
                 )
                 
-                result_text = response.choices[0].message.content.strip()
+                choice = response.choices[0]
+                result = orjson.loads(choice.message.content)
+                confidence = self._label_confidence(choice.logprobs.content) if logprobs else 0.0
+                return result, confidence
                 
-                # Try to parse JSON from the response
-                # Handle markdown code blocks if present
-                if "```json" in result_text:
-                    result_text = result_text.split("```json")[1].split("```")[0].strip()
-                elif "```" in result_text:
-                    result_text = result_text.split("```")[1].split("```")[0].strip()
+            except Exception as e:
+                logger.error(f"API call error (attempt {attempt + 1}/{max_retries}): {e}")
+                if attempt == max_retries - 1:
+                    return {"failure_type": "APIError", "error": str(e)}, 0.0
+        
+        return {"failure_type": "UnknownError"}, 0.0
+    
+    def classify_batch(self, reports: List[Dict], max_retries: int = 3) -> List[Dict]:
+        """
+        Classify several LINAC failure reports with a single API call.
+        
+        Sharing one request amortizes the system prompt and examples over all
+        reports. Reports answered by the keyword rules or the exact-match
+        cache are not sent, and identical reports are sent once.
+        
+        Args:
+            reports: Dictionaries with `subject` and `description` keys.
+            max_retries: Maximum number of retry attempts on failure.
+            
+        Returns:
+            List of classification dictionaries, aligned with `reports`.
+        """
+        pairs = [(r['subject'], r['description']) for r in reports]
+        results = [self._local_result(subject, description) for subject, description in pairs]
+        groups = self._pending_groups(pairs, results)
+        pending = [rows[0] for rows in groups.values()]
+        if not pending:
+            return results
+        
+        messages = self._build_batch_messages([reports[i] for i in pending])
+        for attempt in range(max_retries):
+            try:
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    **self.GENERATION_PARAMS
+                )
                 
-                result = json.loads(result_text)
-                return result
+                items = orjson.loads(response.choices[0].message.content)["classifications"]
+                # Match answers by id rather than position to guard against reordering
+                by_id = {int(item["id"]): item for item in items if "id" in item}
+                for n, i in enumerate(pending, start=1):
+                    item = by_id.get(n)
+                    if item is None or "failure_type" not in item:
+                        results[i] = {"failure_type": "ParseError", "error": f"report {n} missing from response"}
+                        continue
+                    results[i] = {"failure_type": item["failure_type"]}
+                self._fan_out(groups, results)
+                return results
                 
-            except json.JSONDecodeError as e:
-                logger.warning(f"JSON parse error (attempt {attempt + 1}/{max_retries}): {e}")
-                if attempt == max_retries - 1:
-                    return {"failure_type": "ParseError", "raw_response": result_text, "error": str(e)}
-                    
             except Exception as e:
                 logger.error(f"API call error (attempt {attempt + 1}/{max_retries}): {e}")
                 if attempt == max_retries - 1:
-                    return {"failure_type": "APIError", "error": str(e)}
+                    for i in pending:
+                        results[i] = {"failure_type": "APIError", "error": str(e)}
+        
+        self._fan_out(groups, results)
+        return results
+    
+    @retry(
+        retry=retry_if_exception_type(RateLimitError),
+        wait=wait_random_exponential(min=1, max=60),
+        stop=stop_after_attempt(6),
+        reraise=True
+    )
+    async def _request_async(self, subject: str, description: str):
+        """Issue one chat completion request, backing off on rate limits."""
+        return await self.aclient.chat.completions.create(
+            model=self.model,
+            messages=self._build_messages(subject, description),
+            **self.GENERATION_PARAMS
+        )
+    
+    async def _classify_async(self, subject: str, description: str,
+                              sem: asyncio.Semaphore) -> Dict:
+        """
+        Classify a single report without blocking the event loop.
         
-        return {"failure_type": "UnknownError"}
+        Args:
+            subject: Report subject line.
+            description: Report description text.
+            sem: Semaphore bounding the number of in-flight requests.
+            
+        Returns:
+            Dictionary with classification results.
+        """
+        async with sem:
+            try:
+                response = await self._request_async(subject, description)
+                return orjson.loads(response.choices[0].message.content)
+            except Exception as e:
+                logger.error(f"API call error: {e}")
+                return {"failure_type": "APIError", "error": str(e)}
+    
+    @staticmethod
+    def _store_results(df: pd.DataFrame, output_col: str, results: List[Dict]):
+        """Write classification results to `df`, with failure_type in its own column."""
+        df[output_col] = results
+        # Built from the result list directly instead of a per-row apply
+        df['failure_type'] = [
+            x.get('failure_type', 'Error') if isinstance(x, dict) else 'Error'
+            for x in results
+        ]
     
     def classify_dataframe(self, df: pd.DataFrame, 
                           subject_col: str = 'subject',
                           description_col: str = 'description',
-                          output_col: str = 'llm_classification') -> pd.DataFrame:
+                          output_col: str = 'llm_classification',
+                          reports_per_request: int = 1) -> pd.DataFrame:
         """
         Classify all reports in a DataFrame.
         
@@ -165,35 +681,242 @@ Description: {description}
             subject_col: Name of the subject column.
             description_col: Name of the description column.
             output_col: Name of the output column for results.
+            reports_per_request: Number of reports sent per API call. Values
+                above 1 use `classify_batch`, which skips the model cascade and
+                semantic cache in exchange for fewer, cheaper requests.
             
         Returns:
             DataFrame with classification results added.
         """
         logger.info(f"Starting classification of {len(df)} reports...")
         
-        tqdm.pandas(desc="Classifying reports")
-        df[output_col] = df.progress_apply(
-            lambda row: self.classify_report(
-                str(row[subject_col]), 
-                str(row[description_col])
-            ),
-            axis=1
-        )
+        # Iterate over plain arrays rather than boxing each row into a Series
+        subjects = df[subject_col].astype(str).to_numpy()
+        descriptions = df[description_col].astype(str).to_numpy()
         
-        # Extract failure_type to separate column for easier analysis
-        df['failure_type'] = df[output_col].apply(
-            lambda x: x.get('failure_type', 'Error') if isinstance(x, dict) else 'Error'
-        )
+        if reports_per_request > 1:
+            results = []
+            for start in tqdm(range(0, len(df), reports_per_request), desc="Classifying reports"):
+                results.extend(self.classify_batch([
+                    {"subject": subject, "description": description}
+                    for subject, description in zip(subjects[start:start + reports_per_request],
+                                                     descriptions[start:start + reports_per_request])
+                ]))
+        else:
+            if self.semantic_cache_path:
+                # Only reports that will reach the semantic cache need an embedding
+                unanswered = [(s, d) for s, d in zip(subjects, descriptions)
+                              if self._local_result(s, d) is None]
+                self.prefetch_embeddings([s for s, _ in unanswered], [d for _, d in unanswered])
+            results = [
+                self.classify_report(subject, description)
+                for subject, description in tqdm(zip(subjects, descriptions),
+                                                 total=len(df), desc="Classifying reports")
+            ]
+        self._store_results(df, output_col, results)
         
+        self.save_semantic_cache()
+        if self.cheap_model:
+            logger.info(f"Cascade: {self._cascade_counts['cheap']} answered by {self.cheap_model}, "
+                        f"{self._cascade_counts['escalated']} escalated to {self.model}")
         logger.info("Classification complete!")
         return df
+    
+    async def classify_dataframe_async(self, df: pd.DataFrame,
+                                       subject_col: str = 'subject',
+                                       description_col: str = 'description',
+                                       output_col: str = 'llm_classification',
+                                       max_concurrency: int = 20) -> pd.DataFrame:
+        """
+        Classify all reports in a DataFrame with concurrent API calls.
+        
+        Faster alternative to `classify_dataframe` when the Batch API's
+        turnaround is too slow. Up to `max_concurrency` requests are in
+        flight at once; keep it within your account's rate limits. Reports
+        answered by the keyword rules or the exact-match cache are not sent,
+        and identical reports are sent once.
+        
+        Args:
+            df: DataFrame containing reports.
+            subject_col: Name of the subject column.
+            description_col: Name of the description column.
+            output_col: Name of the output column for results.
+            max_concurrency: Maximum number of simultaneous requests.
+            
+        Returns:
+            DataFrame with classification results added.
+        """
+        logger.info(f"Starting async classification of {len(df)} reports...")
+        
+        reports = [(str(subject), str(description))
+                   for subject, description in zip(df[subject_col], df[description_col])]
+        results = [self._local_result(subject, description) for subject, description in reports]
+        groups = self._pending_groups(reports, results)
+        pending = [rows[0] for rows in groups.values()]
+        logger.info(f"{len(df) - len(pending)} reports answered without a separate API call")
+        
+        sem = asyncio.Semaphore(max_concurrency)
+        tasks = [self._classify_async(*reports[i], sem) for i in pending]
+        for i, result in zip(pending, await async_tqdm.gather(*tasks, desc="Classifying reports")):
+            results[i] = result
+        self._fan_out(groups, results)
+        self._store_results(df, output_col, results)
+        
+        logger.info("Classification complete!")
+        return df
+    
+    def _chunk_batch_lines(self, lines: List[bytes]) -> List[Tuple[int, int]]:
+        """Split serialized requests into (start, end) ranges within the Batch API file limits."""
+        chunks = []
+        start = size = 0
+        for i, line in enumerate(lines):
+            if i > start and (i - start >= self.BATCH_MAX_REQUESTS or size + len(line) > self.BATCH_MAX_BYTES):
+                chunks.append((start, i))
+                start, size = i, 0
+            size += len(line)
+        if start < len(lines):
+            chunks.append((start, len(lines)))
+        return chunks
+    
+    def _submit_batch(self, lines: List[bytes]):
+        """Upload serialized requests as an in-memory JSONL file and start a batch."""
+        buf = io.BytesIO(b"".join(lines))
+        buf.name = "linac_batch.jsonl"
+        
+        input_file = self.client.files.create(file=buf, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        logger.info(f"Created batch {batch.id} with {len(lines)} requests")
+        return batch
+    
+    def _wait_for_batch(self, batch, poll_interval: float, max_poll_interval: float):
+        """Poll with exponential backoff until the batch reaches a final state."""
+        delay = poll_interval
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(delay)
+            delay = min(delay * 2, max_poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+            logger.info(f"Batch {batch.id} status: {batch.status}")
+        return batch
+    
+    def _read_batch_file(self, file_id: str, results: List[Dict]):
+        """Store the classifications or errors in a batch output/error file by row."""
+        content = self.client.files.content(file_id)
+        # orjson parses the raw UTF-8 bytes without decoding to str first
+        for line in content.content.splitlines():
+            if not line.strip():
+                continue
+            item = orjson.loads(line)
+            idx = int(item["custom_id"].split("-", 1)[1])
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                results[idx] = {"failure_type": "APIError", "error": str(item.get("error") or response.get("body"))}
+                continue
+            result_text = response["body"]["choices"][0]["message"]["content"]
+            try:
+                results[idx] = orjson.loads(result_text)
+            except orjson.JSONDecodeError as e:
+                results[idx] = {"failure_type": "ParseError", "raw_response": result_text, "error": str(e)}
+    
+    def classify_dataframe_batch(self, df: pd.DataFrame,
+                                 subject_col: str = 'subject',
+                                 description_col: str = 'description',
+                                 output_col: str = 'llm_classification',
+                                 poll_interval: float = 2.0,
+                                 max_poll_interval: float = 120.0) -> pd.DataFrame:
+        """
+        Classify all reports in a DataFrame using the OpenAI Batch API.
+        
+        Rows are submitted as JSONL batches of up to `BATCH_MAX_REQUESTS`
+        requests and `BATCH_MAX_BYTES` bytes, which are billed at a discount and processed server-side in
+        parallel. The call blocks until every batch finishes (up to the 24h
+        completion window). Reports answered by the keyword rules or the
+        exact-match cache are not submitted, and identical reports are
+        submitted once.
+        
+        Args:
+            df: DataFrame containing reports.
+            subject_col: Name of the subject column.
+            description_col: Name of the description column.
+            output_col: Name of the output column for results.
+            poll_interval: Initial seconds between status checks.
+            max_poll_interval: Upper bound for the polling backoff.
+            
+        Returns:
+            DataFrame with classification results added.
+        """
+        logger.info(f"Submitting batch classification of {len(df)} reports...")
+        
+        reports = [(str(subject), str(description))
+                   for subject, description in zip(df[subject_col], df[description_col])]
+        results = [self._local_result(subject, description) for subject, description in reports]
+        groups = self._pending_groups(reports, results)
+        pending = [rows[0] for rows in groups.values()]
+        logger.info(f"{len(df) - len(pending)} reports answered without a separate API call")
+        
+        # One JSONL line per distinct report; custom_id carries its first row for the join
+        lines = [
+            orjson.dumps({
+                "custom_id": f"row-{i}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model,
+                    "messages": self._build_messages(*reports[i]),
+                    **self.GENERATION_PARAMS
+                }
+            }) + b"\n"
+            for i in pending
+        ]
+        
+        for i in pending:
+            results[i] = {"failure_type": "UnknownError"}
+        
+        # Submit every chunk up front so the batches are processed concurrently
+        batches = []
+        for start, end in self._chunk_batch_lines(lines):
+            rows = pending[start:end]
+            try:
+                batches.append((rows, self._submit_batch(lines[start:end])))
+            except Exception as e:
+                # Only this chunk is lost; batches already submitted still run
+                logger.error(f"Batch submission error for {len(rows)} requests: {e}")
+                for idx in rows:
+                    results[idx] = {"failure_type": "APIError", "error": str(e)}
+        
+        for rows, batch in batches:
+            batch = self._wait_for_batch(batch, poll_interval, max_poll_interval)
+            if batch.status != "completed":
+                logger.error(f"Batch {batch.id} ended with status: {batch.status}")
+                for idx in rows:
+                    results[idx] = {"failure_type": "APIError", "error": f"batch {batch.status}"}
+                continue
+            
+            # Successful requests go to the output file, failed ones to the error file
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    self._read_batch_file(file_id, results)
+            if batch.error_file_id:
+                logger.warning(f"Batch {batch.id} completed with "
+                               f"{batch.request_counts.failed} of {len(rows)} requests failed")
+        
+        self._fan_out(groups, results)
+        self._store_results(df, output_col, results)
+        
+        logger.info("Batch classification complete!")
+        return df
 
 
 def main():
     """Main execution function."""
     # Configuration
-    INPUT_FILE = Path('/Users/yeochanyoun/Desktop/projects/LINAC_prediction/clean_data/df_full_desc.csv')
-    OUTPUT_FILE = Path('output/classified_reports.csv')
+    INPUT_FILE = Path('/Users/yeochanyoun/Desktop/projects/LINAC_prediction/clean_data/df_full_desc.parquet')
+    OUTPUT_FILE = Path('output/classified_reports.parquet')
+    CACHE_FILE = Path('output/classification_cache.json')
+    SAVE_CSV = False  # Also write a CSV copy for manual inspection
     
     # Create output directory if it doesn't exist
     OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
@@ -201,18 +924,27 @@ def main():
     try:
         # Load data
         logger.info(f"Loading data from {INPUT_FILE}...")
-        df = pd.read_csv(INPUT_FILE)
+        if INPUT_FILE.suffix == '.parquet':
+            df = pd.read_parquet(INPUT_FILE)
+        else:
+            df = pd.read_csv(INPUT_FILE)
         logger.info(f"Loaded {len(df)} reports")
         
         # Initialize classifier
-        classifier = LINACFailureClassifier(model="gpt-4o")
+        classifier = LINACFailureClassifier(model="gpt-4o", exact_cache_path=CACHE_FILE)
         
         # Classify reports
         df_classified = classifier.classify_dataframe(df)
         
         # Save results
         logger.info(f"Saving results to {OUTPUT_FILE}...")
-        df_classified.to_csv(OUTPUT_FILE, index=False)
+        # Classification dicts vary in keys, so store them as JSON strings
+        df_out = df_classified.assign(
+            llm_classification=df_classified['llm_classification'].map(json.dumps)
+        )
+        df_out.to_parquet(OUTPUT_FILE, engine="pyarrow", compression="zstd", index=False)
+        if SAVE_CSV:
+            df_out.to_csv(OUTPUT_FILE.with_suffix('.csv'), index=False)
         
         # Print summary statistics
         logger.info("\n=== Classification Summary ===")
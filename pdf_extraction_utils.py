@@ -0,0 +1,71 @@
+import os
+import contextlib
+import hashlib
+import shelve
+import fitz  # PyMuPDF
+
+# PyMuPDF's default "text" flags with ligature preservation turned off, so that
+# ligature glyphs come out as plain letters ("fi", "fl") for the regexes. This
+# normalises the text; it does not make extraction measurably faster.
+TEXT_FLAGS = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_LIGATURES
+
+# Characters of the previous text kept when searching a new page, so that
+# single-field matches crossing a page break are still found
+PAGE_OVERLAP = 500
+
+def search_pages(doc, patterns, anchors=None, flags=TEXT_FLAGS):
+    """Search a PyMuPDF document page by page, stopping once every pattern has matched.
+
+    Each pattern is searched only in the new page plus the last PAGE_OVERLAP
+    characters before it. Patterns listed in `anchors` capture multiple lines
+    and map to a regex of their opening marker: once the marker is seen, the
+    text from it onwards is kept and rescanned as pages are added.
+    """
+    anchors = anchors or {}
+    matches = {}
+    buffers = {}  # text from each multi-line capture's anchor onwards
+    tail = ""
+    for i, page in enumerate(doc):
+        page_text = page.get_text("text", flags=flags, sort=False)
+        window = page_text if i == 0 else f"{tail}\n{page_text}"
+        for name, pattern in patterns.items():
+            if name in matches:
+                continue
+            if name in anchors:
+                if name in buffers:
+                    buffers[name] = f"{buffers[name]}\n{page_text}"
+                else:
+                    anchor = anchors[name].search(window)
+                    if not anchor:
+                        continue
+                    buffers[name] = window[anchor.start():]
+                match = pattern.search(buffers[name])
+            else:
+                match = pattern.search(window)
+            if match:
+                matches[name] = match
+        if len(matches) == len(patterns):
+            break
+        tail = window[-PAGE_OVERLAP:]
+    return matches
+
+def extractor_fingerprint(version, *pattern_dicts):
+    """Hash identifying an extractor by its version, regexes and text flags.
+
+    `version` is a module's _EXTRACTOR_VERSION, bumped whenever its extraction
+    logic changes; edits to the regexes, TEXT_FLAGS or PyMuPDF itself change
+    the hash on their own.
+    """
+    parts = [str(version), str(TEXT_FLAGS), fitz.VersionBind]
+    for patterns in pattern_dicts:
+        parts.extend(f"{name}:{p.flags}:{p.pattern}" for name, p in sorted(patterns.items()))
+    return hashlib.sha1("\x00".join(parts).encode("utf-8")).hexdigest()[:12]
+
+def open_cache(cache_path):
+    """Open the extraction cache, or an in-memory dict if caching is disabled."""
+    return shelve.open(cache_path) if cache_path else contextlib.nullcontext({})
+
+def cache_key(path, fingerprint):
+    """Cache key of a PDF: its path, mtime and size, and the extractor fingerprint."""
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}:{st.st_mtime_ns}:{st.st_size}:{fingerprint}"
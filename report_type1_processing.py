@@ -1,29 +1,39 @@
 import os
-import pdfplumber
+from concurrent.futures import ProcessPoolExecutor
+from pdf_extraction_utils import cache_key, extractor_fingerprint, open_cache, search_pages
+import fitz  # PyMuPDF
 import re
 import pandas as pd
 from tqdm import tqdm
 
+# Optimized regex patterns for accurate extraction, compiled once at import
+_PATTERNS = {
+    'work_order_id': re.compile(r"Work Order\s+WO-(\d+)"),
+    'machine_id': re.compile(r"Asset\s+(\S+)"),
+    'subject': re.compile(r"Subject\s+(.+)"),
+    # Lines up to "Work Order Times"; a tempered token instead of a lazy [\s\S]+?
+    'description': re.compile(r"Closure Summary\s+(?=\S)((?:[^\n]|\n(?!Work Order Times))+)\nWork Order Times"),
+    'malfunction_start': re.compile(r"Malfunction Start\s*:\s*([\d/]+ [\d:]+ [APM]+)"),
+    'machine_release': re.compile(r"Machine Release\s*([\d/]+ [\d:]+ [APM]+)"),
+    'time_in': re.compile(r"Time In\s*([\d/]+ [\d:]+ [APM]+)"),
+    'time_out': re.compile(r"Time Out\s*([\d/]+ [\d:]+ [APM]+)"),
+    'down_time_hours': re.compile(r"Agreed Downtime\s*(\d+\.?\d*)"),
+    'site_hours': re.compile(r"Site Hours\s*(\d+\.?\d*)"),
+    'travel_hours': re.compile(r"Travel Hours\s*(\d+\.?\d*)"),
+    'total_work_hours': re.compile(r"Total Work Hours\s*(\d+\.?\d*)"),
+}
+
+# Opening markers of the captures that may continue onto later pages
+_ANCHORS = {
+    'description': re.compile(r"Closure Summary"),
+}
+
 def extract_data_from_pdf(pdf_path):
     """Extracts key data from a given PDF file."""
-    with pdfplumber.open(pdf_path) as pdf:
-        text = "\n".join([page.extract_text() for page in pdf.pages if page.extract_text()])
-
-    extracted_data = {}
-
-    # Optimized regex patterns for accurate extraction
-    extracted_data['work_order_id'] = re.search(r"Work Order\s+WO-(\d+)", text)
-    extracted_data['machine_id'] = re.search(r"Asset\s+(\S+)", text)
-    extracted_data['subject'] = re.search(r"Subject\s+(.+)", text)
-    extracted_data['description'] = re.search(r"Closure Summary\s+([\s\S]+?)\nWork Order Times", text)  
-    extracted_data['malfunction_start'] = re.search(r"Malfunction Start\s*:\s*([\d/]+ [\d:]+ [APM]+)", text)
-    extracted_data['machine_release'] = re.search(r"Machine Release\s*([\d/]+ [\d:]+ [APM]+)", text)
-    extracted_data['time_in'] = re.search(r"Time In\s*([\d/]+ [\d:]+ [APM]+)", text)
-    extracted_data['time_out'] = re.search(r"Time Out\s*([\d/]+ [\d:]+ [APM]+)", text)
-    extracted_data['down_time_hours'] = re.search(r"Agreed Downtime\s*(\d+\.?\d*)", text)
-    extracted_data['site_hours'] = re.search(r"Site Hours\s*(\d+\.?\d*)", text)
-    extracted_data['travel_hours'] = re.search(r"Travel Hours\s*(\d+\.?\d*)", text)
-    extracted_data['total_work_hours'] = re.search(r"Total Work Hours\s*(\d+\.?\d*)", text)
+    with fitz.open(pdf_path) as doc:
+        matches = search_pages(doc, _PATTERNS, _ANCHORS)
+
+    extracted_data = {key: matches.get(key) for key in _PATTERNS}
     
     # Extract matched values or set None if not found
     for key, match in extracted_data.items():
@@ -39,14 +49,32 @@ def extract_data_from_pdf(pdf_path):
 
     return extracted_data
 
-def process_multiple_pdfs(pdf_files):
-    """Processes multiple PDF files and saves extracted data into a Pandas DataFrame."""
-    results = []
-    
-    for pdf_file in tqdm(pdf_files, desc="Processing PDFs"):
-        extracted_data = extract_data_from_pdf(pdf_file)
+# Extracted results are cached on disk, keyed on file path, mtime, size and
+# the extractor fingerprint
+_CACHE_PATH = ".pdf_cache_type1"
+
+# Bump when the extraction logic changes, so that cached results are re-extracted
+_EXTRACTOR_VERSION = 1
+_FINGERPRINT = extractor_fingerprint(_EXTRACTOR_VERSION, _PATTERNS, _ANCHORS)
+
+def process_multiple_pdfs(pdf_files, max_workers=None, cache_path=_CACHE_PATH):
+    """Processes multiple PDF files in parallel and saves extracted data into a Pandas DataFrame.
+
+    Files unchanged since a previous run are read from the cache at `cache_path`
+    instead of being parsed again; pass None to disable caching.
+    """
+    with open_cache(cache_path) as cache:
+        keys = [cache_key(pdf_file, _FINGERPRINT) for pdf_file in pdf_files]
+        results = [cache.get(key) for key in keys]
+        pending = [i for i, extracted_data in enumerate(results) if extracted_data is None]
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            extracted = executor.map(extract_data_from_pdf, [pdf_files[i] for i in pending], chunksize=4)
+            for i, extracted_data in tqdm(zip(pending, extracted), total=len(pending), desc="Processing PDFs"):
+                results[i] = cache[keys[i]] = extracted_data
+
+    for pdf_file, extracted_data in zip(pdf_files, results):
         extracted_data["file_name"] = os.path.basename(pdf_file)  # Store the file name for reference
-        results.append(extracted_data)
 
     # Convert results to Pandas DataFrame
     df = pd.DataFrame(results)
@@ -57,6 +85,10 @@ def process_multiple_pdfs(pdf_files):
 
 if __name__ == "__main__":
     directory_path = "Input file dir path"
+    output_file = "Output result path"  # .parquet
+    save_csv = False  # Also write a CSV copy for manual inspection
     pdf_files = [os.path.join(directory_path, f) for f in os.listdir(directory_path) if f.endswith('.pdf')]
     df_results = process_multiple_pdfs(pdf_files)
-    df_results.to_csv("Output result path", index=False)
+    df_results.to_parquet(output_file, engine="pyarrow", compression="zstd", index=False)
+    if save_csv:
+        df_results.to_csv(os.path.splitext(output_file)[0] + ".csv", index=False)
@@ -1,35 +1,55 @@
 import fitz  # PyMuPDF
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+from pdf_extraction_utils import TEXT_FLAGS, cache_key, extractor_fingerprint, open_cache
 import pandas as pd
 from tqdm import tqdm
 
+# Regex patterns compiled once at import, with their flags baked in
+_PATTERNS = {
+    "time_entries": re.compile(r"(\d{1,2}/\d{1,2}/\d{4})\s+(\d{1,2}:\d{2}\s+[AP]M)\s+(\d{1,2}:\d{2}\s+[AP]M)"),
+    "work_order_id": re.compile(r"Notification No\.\s+(\d+)"),
+    "machine_id": re.compile(r"Equipment ID\s+Equipment Name\s+([A-Z0-9]+)"),
+    "subject": re.compile(r"Reason for Call\s+([^\n]+)"),
+    "malfunction_start": re.compile(r"Event Date\s+([\d/]+\s+\d+:\d+:\d+\s+[AP]M?)"),
+    "machine_release": re.compile(r"Equipment Released\s+Customer Signature\s+(\d{1,2}/\d{1,2}/\d{4}\s+\d{1,2}:\d{2}\s+[AP]M)"),
+    "hours_block": re.compile(r"Total [^\n]*?\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)"),
+}
+
 def extract_report_data(file_path):
     with fitz.open(file_path) as doc:
-        text = "\n".join(page.get_text() for page in doc)
+        text = "\n".join(page.get_text("text", flags=TEXT_FLAGS, sort=False) for page in doc)
     filename = os.path.splitext(os.path.basename(file_path))[0]
 
-    def find(pattern, group=1, flags=0, fallback=""):
-        match = re.search(pattern, text, flags)
+    def find(compiled, group=1, fallback=""):
+        match = compiled.search(text)
         return match.group(group).strip() if match else fallback
 
+    def find_between(start_marker, end_marker, fallback=""):
+        # Plain substring search in place of a DOTALL lazy capture
+        start = text.find(start_marker)
+        if start == -1:
+            return fallback
+        start += len(start_marker)
+        end = text.find(end_marker, start)
+        return text[start:end].strip() if end != -1 else fallback
+
     # Extract time in/out from service time table
-    time_entries = re.findall(
-        r"(\d{1,2}/\d{1,2}/\d{4})\s+(\d{1,2}:\d{2}\s+[AP]M)\s+(\d{1,2}:\d{2}\s+[AP]M)", text
-    )
+    time_entries = _PATTERNS["time_entries"].findall(text)
     time_in = f"{time_entries[0][0]} {time_entries[0][1]}" if time_entries else ""
     time_out = f"{time_entries[-1][0]} {time_entries[-1][2]}" if time_entries else ""
 
     # Extract core metadata
-    work_order_id = find(r"Notification No\.\s+(\d+)")
-    machine_id = find(r"Equipment ID\s+Equipment Name\s+([A-Z0-9]+)")
-    subject = find(r"Reason for Call\s+([^\n]+)")
-    description = find(r"Corrective Action Comments(.*?)Times on site", flags=re.DOTALL).strip()
-    malfunction_start = find(r"Event Date\s+([\d/]+\s+\d+:\d+:\d+\s+[AP]M?)")
-    machine_release = find(r"Equipment Released\s+Customer Signature\s+(\d{1,2}/\d{1,2}/\d{4}\s+\d{1,2}:\d{2}\s+[AP]M)")
+    work_order_id = find(_PATTERNS["work_order_id"])
+    machine_id = find(_PATTERNS["machine_id"])
+    subject = find(_PATTERNS["subject"])
+    description = find_between("Corrective Action Comments", "Times on site")
+    malfunction_start = find(_PATTERNS["malfunction_start"])
+    machine_release = find(_PATTERNS["machine_release"])
 
     # Extract hours from totals line
-    hours_block = re.search(r"Total [^\n]*?\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)", text)
+    hours_block = _PATTERNS["hours_block"].search(text)
     if hours_block:
         travel_hours, total_work_hours, site_hours = hours_block.groups()
     else:
@@ -52,13 +72,28 @@ def extract_report_data(file_path):
         "file_name": filename
     }
 
-def extract_from_folder(folder_path):
+# Extracted results are cached on disk, keyed on file path, mtime, size and
+# the extractor fingerprint
+_CACHE_PATH = ".pdf_cache_type2"
+
+# Bump when the extraction logic changes, so that cached results are re-extracted
+_EXTRACTOR_VERSION = 1
+_FINGERPRINT = extractor_fingerprint(_EXTRACTOR_VERSION, _PATTERNS)
+
+def extract_from_folder(folder_path, max_workers=None, cache_path=_CACHE_PATH):
     pdf_files = [f for f in os.listdir(folder_path) if f.lower().endswith(".pdf")]
-    data = []
+    full_paths = [os.path.join(folder_path, file) for file in pdf_files]
+
+    # Only parse PDFs that are new or changed since they were last cached
+    with open_cache(cache_path) as cache:
+        keys = [cache_key(path, _FINGERPRINT) for path in full_paths]
+        data = [cache.get(key) for key in keys]
+        pending = [i for i, record in enumerate(data) if record is None]
 
-    for file in tqdm(pdf_files, desc="Processing PDFs"):
-        full_path = os.path.join(folder_path, file)
-        data.append(extract_report_data(full_path))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            extracted = executor.map(extract_report_data, [full_paths[i] for i in pending], chunksize=4)
+            for i, record in tqdm(zip(pending, extracted), total=len(pending), desc="Processing PDFs"):
+                data[i] = cache[keys[i]] = record
 
     df = pd.DataFrame(data)
     return df
@@ -67,5 +102,9 @@ def extract_from_folder(folder_path):
 # === Run the extraction ===
 if __name__ == "__main__":
     folder = "Input file dir path"  # <-- Change this!
+    output_file = "Output result path"  # .parquet
+    save_csv = False  # Also write a CSV copy for manual inspection
     df = extract_from_folder(folder)
-    df.to_csv("Output result path", index=False)
+    df.to_parquet(output_file, engine="pyarrow", compression="zstd", index=False)
+    if save_csv:
+        df.to_csv(os.path.splitext(output_file)[0] + ".csv", index=False)
@@ -1,41 +1,60 @@
 import fitz  # PyMuPDF
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+from pdf_extraction_utils import cache_key, extractor_fingerprint, open_cache, search_pages
 import pandas as pd
 
+# Regex patterns compiled once at import, with their flags baked in
+_PATTERNS = {
+    "times": re.compile(
+        r"Time In\s+Time Out\s+Malfunction Start\s+Machine Release Time\s+"
+        r"(\d{2}/\d{2}/\d{4} \d{2}:\d{2})\s+"
+        r"(\d{2}/\d{2}/\d{4} \d{2}:\d{2})\s+"
+        r"(\d{2}/\d{2}/\d{4} \d{2}:\d{2})\s+"
+        r"(\d{2}/\d{2}/\d{4} \d{2}:\d{2})"),
+    "work_order_id": re.compile(r"Work Order Number\s+(WO-\d+)"),
+    "machine_id": re.compile(r"Installed Product\s+([A-Z0-9]+)"),
+    "subject": re.compile(r"Problem Description\s+([^\n]+?)(?:\n|Work Performed Comments)"),
+    # Lines up to the next blank line or "Follow Up Comments", without DOTALL backtracking
+    "description": re.compile(
+        r"Work Performed Comments\s+(?=\S)((?:[^\n]|\n(?!\n|Follow Up Comments))+)(?:\nFollow Up Comments|\n\n)"),
+    "hours": re.compile(
+        r"Total Travel Hours\s+Total Work Hours\s+Total Site Hours\s+Agreed Downtime\s*\n"
+        r"([0-9.]+)\s+([0-9.]+)\s+([0-9.]+)"),
+}
+
+# Opening markers of the captures that may continue onto later pages
+_ANCHORS = {
+    "description": re.compile(r"Work Performed Comments"),
+}
+
 def extract_report_data(file_path):
     """Extract structured service report data from a single Varian PDF."""
     with fitz.open(file_path) as doc:
-        text = "\n".join(page.get_text() for page in doc)
+        matches = search_pages(doc, _PATTERNS, _ANCHORS)
 
     filename = os.path.splitext(os.path.basename(file_path))[0]
 
-    def find(pattern, group=1, flags=0, fallback=""):
-        match = re.search(pattern, text, flags)
+    def find(name, group=1, fallback=""):
+        match = matches.get(name)
         return match.group(group).strip() if match else fallback
 
     # Extract timestamps (Time In, Time Out, Malfunction Start, Machine Release)
     time_in = time_out = malfunction_start = machine_release = ""
-    times_match = re.search(
-        r"Time In\s+Time Out\s+Malfunction Start\s+Machine Release Time\s+"
-        r"(\d{2}/\d{2}/\d{4} \d{2}:\d{2})\s+"
-        r"(\d{2}/\d{2}/\d{4} \d{2}:\d{2})\s+"
-        r"(\d{2}/\d{2}/\d{4} \d{2}:\d{2})\s+"
-        r"(\d{2}/\d{2}/\d{4} \d{2}:\d{2})", text)
+    times_match = matches.get("times")
     if times_match:
         time_in, time_out, malfunction_start, machine_release = times_match.groups()
 
     # Extract metadata fields
-    work_order_id = find(r"Work Order Number\s+(WO-\d+)")
-    machine_id = find(r"Installed Product\s+([A-Z0-9]+)")
-    subject = find(r"Problem Description\s+(.+?)(?:\n|Work Performed Comments)", flags=re.DOTALL)
-    description = find(r"Work Performed Comments\s+(.+?)(?:\nFollow Up Comments|\n\n)", flags=re.DOTALL)
+    work_order_id = find("work_order_id")
+    machine_id = find("machine_id")
+    subject = find("subject")
+    description = find("description")
 
     # Extract hours
     site_hours = travel_hours = total_work_hours = ""
-    hours_match = re.search(
-        r"Total Travel Hours\s+Total Work Hours\s+Total Site Hours\s+Agreed Downtime\s*\n"
-        r"([0-9.]+)\s+([0-9.]+)\s+([0-9.]+)", text)
+    hours_match = matches.get("hours")
     if hours_match:
         travel_hours, total_work_hours, site_hours = hours_match.groups()
 
@@ -56,18 +75,41 @@ def extract_report_data(file_path):
         "file_name": filename
     }
 
-def extract_from_folder(folder_path):
-    """Batch extract all PDFs in a folder."""
+# Extracted results are cached on disk, keyed on file path, mtime, size and
+# the extractor fingerprint
+_CACHE_PATH = ".pdf_cache_type3"
+
+# Bump when the extraction logic changes, so that cached results are re-extracted
+_EXTRACTOR_VERSION = 1
+_FINGERPRINT = extractor_fingerprint(_EXTRACTOR_VERSION, _PATTERNS, _ANCHORS)
+
+def extract_from_folder(folder_path, max_workers=None, cache_path=_CACHE_PATH):
+    """Batch extract all PDFs in a folder using a pool of worker processes.
+
+    PDFs unchanged since they were cached at `cache_path` are not parsed again;
+    pass None to disable caching.
+    """
     pdf_files = [f for f in os.listdir(folder_path) if f.lower().endswith(".pdf")]
-    data = [extract_report_data(os.path.join(folder_path, f)) for f in pdf_files]
+    full_paths = [os.path.join(folder_path, f) for f in pdf_files]
+    with open_cache(cache_path) as cache:
+        keys = [cache_key(path, _FINGERPRINT) for path in full_paths]
+        data = [cache.get(key) for key in keys]
+        pending = [i for i, record in enumerate(data) if record is None]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            extracted = executor.map(extract_report_data, [full_paths[i] for i in pending], chunksize=4)
+            for i, record in zip(pending, extracted):
+                data[i] = cache[keys[i]] = record
     return pd.DataFrame(data)
 
 # === Script Execution ===
 if __name__ == "__main__":
     # CHANGE THIS to your PDF folder path
     folder = "Input file dir path"
-    output_file = "Output result path"
+    output_file = "Output result path"  # .parquet
+    save_csv = False  # Also write a CSV copy for manual inspection
 
     df = extract_from_folder(folder)
-    df.to_csv(output_file, index=False)
+    df.to_parquet(output_file, engine="pyarrow", compression="zstd", index=False)
+    if save_csv:
+        df.to_csv(os.path.splitext(output_file)[0] + ".csv", index=False)
     print(f"Extraction complete. Output saved to: {output_file}")